@@ -0,0 +1,42 @@
+import json
+import typing
+
+from datetime import datetime, timezone
+
+
+def _default(obj: typing.Any) -> typing.Any:
+    """
+    Serializes datetimes the same way orjson does, treating naive datetimes as UTC
+    """
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# orjson is an optional extra, so serialization may differ depending on whether it's installed;
+# see the fallback below for the differences
+try:
+    import orjson
+
+    def dumps(obj: typing.Any) -> str:
+        """
+        Serializes an object to compact JSON using orjson
+        """
+        return orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC).decode()
+
+except ImportError:  # pragma: no cover
+
+    def dumps(obj: typing.Any) -> str:
+        """
+        Serializes an object to compact JSON using the standard library
+
+        For the strings, numbers, lists, dicts and datetimes that make up log entries, this
+        produces the same output as orjson. Other values are handled differently: orjson
+        serializes UUIDs and dataclasses, but raises TypeError for non-str dict keys, lone
+        surrogates and integers wider than 64 bits, while the standard library does the reverse
+        """
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":"), default=_default
+        )
@@ -1,39 +1,189 @@
+import asyncio
 import logging
 import sys
+import threading
 import time
 import typing
 
 from datetime import datetime
-from pydantic_core import Url
-from starlette.datastructures import Headers
+from urllib.parse import quote
 from starlette.types import ASGIApp, Message, Receive, Send, Scope
-from starlette.requests import Request
 
 from .context import get_user_id, set_http_request, utcnow
 from .pylogging import GKELoggingFormatter
 from .types import HttpRequest
 
 
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+# Characters that are legal unescaped in a URL path, per RFC 3986
+_PATH_SAFE_CHARS = "/:@!$&'()*+,;=~"
+# The only request headers needed for logging (ASGI header names are always lowercased)
+_REQUEST_HEADERS = frozenset((b"content-length", b"user-agent", b"referer", b"host"))
+
+
 def build_http_request_from_scope(scope: Scope) -> HttpRequest:
     """
     Converts an ASGI scope into a partially-complete HttpRequest object suitable for GKE structured
     JSON logging
     """
 
-    req = Request(scope)
-    server_ip, _ = req.scope["server"]
-    protocol = f"HTTP/{req.scope['http_version']}"
-    return HttpRequest(
-        protocol=protocol,
-        method=req.method,
-        url=Url(str(req.url)),
+    # Read straight from the scope rather than through starlette's Request, which allocates URL
+    # and Headers objects we'd only use a handful of values from
+    headers: typing.Dict[bytes, str] = {}
+    for name, value in scope["headers"]:
+        if name in _REQUEST_HEADERS:
+            # Like starlette, the first occurrence of a repeated header wins
+            headers.setdefault(name, value.decode("latin-1"))
+    host = headers.get(b"host")
+
+    # Reconstruct the URL the same way starlette does
+    scheme = scope.get("scheme", "http")
+    server_ip, server_port = scope["server"]
+    if host is None:
+        if server_port == _DEFAULT_PORTS.get(scheme):
+            host = server_ip
+        else:
+            host = f"{server_ip}:{server_port}"
+    # scope["path"] is already percent-decoded, so prefer the path as it was originally sent
+    raw_path = scope.get("raw_path")
+    request_target = (
+        raw_path.decode("latin-1")
+        if raw_path
+        else quote(scope["path"], safe=_PATH_SAFE_CHARS)
+    )
+    query_string = scope.get("query_string", b"")
+    if query_string:
+        request_target += f"?{query_string.decode('latin-1')}"
+    url = f"{scheme}://{host}{request_target}"
+
+    client = scope.get("client")
+    http_request = HttpRequest(
+        protocol=f"HTTP/{scope['http_version']}",
+        method=scope["method"],
+        url=url,
         # TODO: Confirm if this is accurate even for body-less requests
-        request_size=req.headers.get("Content-Length"),
-        user_agent=req.headers.get("User-Agent"),
-        remote_ip=req.client.host if req.client else None,
+        request_size=headers.get(b"content-length"),
+        user_agent=headers.get(b"user-agent"),
+        remote_ip=client[0] if client else None,
         server_ip=server_ip,
-        referer=req.headers.get("Referer"),
+        referer=headers.get(b"referer"),
     )
+    http_request.set_request_target(request_target or "/")
+    http_request.freeze_static_fields()
+    return http_request
+
+
+class _DashDict(dict):
+    """
+    Format data that renders any missing or None values as a dash, per the common log format
+    """
+
+    def __missing__(self, key: str) -> str:
+        return "-"
+
+    def __getitem__(self, key: str) -> typing.Any:
+        value = super().__getitem__(key)
+        return "-" if value is None else value
+
+
+class _AsyncBatchingHandler(logging.Handler):
+    """
+    Handler that formats entries in the logging task, then buffers them to be written out in
+    batches by a drain callback scheduled on the same event loop, coalescing the writes of
+    concurrent requests into as few as possible
+
+    Entries logged while the handler isn't bound to a running asyncio event loop, e.g. before
+    start() has been called, under trio, or after the loop has stopped, are written out
+    immediately. Empty entries, i.e. those discarded
+    by GKELoggingFormatter's min_level, are not written at all
+    """
+
+    def __init__(self, stream: typing.TextIO, max_batch_size: int = 100):
+        super().__init__()
+        self._stream = stream
+        self._max_batch_size = max_batch_size
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: typing.Optional[int] = None
+        self._buffer: typing.List[str] = []
+        self._drain_scheduled = False
+
+    def start(self) -> None:
+        """
+        Binds the handler to the running event loop, unless it's already bound to it
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running under asyncio (e.g. trio via anyio), so entries are written out directly
+            return
+        if self._loop is loop:
+            return
+        # Write out anything left over from a previous event loop, which may have been closed
+        # before its drain callback got to run
+        self.flush()
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._drain_scheduled = False
+
+    def _enqueue(self, msg: str) -> None:
+        """
+        Buffers an entry, scheduling a drain for the next event loop iteration if needed
+        """
+        self._buffer.append(msg)
+        if not self._drain_scheduled and self._loop is not None:
+            # A callback rather than a long-lived task, so that nothing is left pending if the
+            # loop is closed without its tasks being cancelled
+            self._loop.call_soon(self._drain)
+            self._drain_scheduled = True
+
+    def _drain(self) -> None:
+        self._drain_scheduled = False
+        self.flush()
+
+    def _write(self, batch: typing.List[str]) -> None:
+        self._stream.write("\n".join(batch) + "\n")
+        self._stream.flush()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            msg = self.format(record)
+            if not msg:
+                return
+            loop = self._loop
+            if loop is not None and loop.is_running():
+                if threading.get_ident() == self._loop_thread_id:
+                    self._enqueue(msg)
+                    return
+                # The buffer is only touched from the loop, so hand off entries logged from other
+                # threads
+                try:
+                    loop.call_soon_threadsafe(self._enqueue, msg)
+                    return
+                except RuntimeError:
+                    pass  # The loop was closed in the meantime
+            # There's no running event loop to drain the entry, so write it out directly
+            self.flush()
+            self._write([msg])
+        except RecursionError:  # pragma: no cover
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """
+        Writes out any buffered entries immediately
+        """
+        self.acquire()
+        try:
+            buffer, self._buffer = self._buffer, []
+            for i in range(0, len(buffer), self._max_batch_size):
+                self._write(buffer[i : i + self._max_batch_size])
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
 
 
 class GKELoggingMiddleware:
@@ -43,6 +193,11 @@ class GKELoggingMiddleware:
 
     Under the hood, this works by leveraging the GKELoggingFormatter and setting the httpRequest via
     contextvar scoped to each incoming request.
+
+    Access log entries are formatted within the request context, then buffered and written out to
+    stdout in batches by a callback on the server's event loop, so that concurrent requests share
+    write calls. Call close() on shutdown to flush any pending entries (this is also done by
+    logging.shutdown() at interpreter exit).
     """
 
     """
@@ -88,43 +243,75 @@ class GKELoggingMiddleware:
             self._logger = logging.Logger(access_log, level=logging.INFO)
         else:
             self._logger = access_log
-        h = logging.StreamHandler(sys.stdout)
-        h.setFormatter(GKELoggingFormatter(**formatter_args))
-        self._logger.addHandler(h)
+        self._handler = _AsyncBatchingHandler(sys.stdout)
+        self._handler.setFormatter(GKELoggingFormatter(**formatter_args))
+        self._logger.addHandler(self._handler)
         self._access_log_message_format = access_log_message_format
+        # The default format is rendered by a specialized f-string rather than str.format()
+        self._use_fast_format = (
+            access_log_message_format is GKELoggingMiddleware.common_log_format
+        )
+
+    def close(self) -> None:
+        """
+        Closes the access log handler, writing out any entries still buffered
+        """
+        self._handler.close()
 
     def log_request(self, request_time: datetime, http_request: HttpRequest):
         """
         Logs out the current request using the configured access_log_message_format
         """
 
-        timestamp = request_time.strftime("%d/%b/%Y:%H:%M:%S %z")
-        url_with_query: str = http_request.url.path or "/"
-        if http_request.url.query:
-            url_with_query += f"?{http_request.url.query}"
-        data = dict(
-            remote_addr=http_request.remote_ip,
-            ident=None,
-            user_id=get_user_id(),
-            timestamp=timestamp,
-            request_line=f"{http_request.method} {url_with_query} {http_request.protocol}",
-            status_code=http_request.status,
-            response_length=http_request.response_size,
-            referer=http_request.referer,
-            user_agent=http_request.user_agent,
-        )
-        data = {k: v if v is not None else "-" for k, v in data.items()}
-        log_line = self._access_log_message_format.format(**data)
-
         # Log levels should reflect status code
         if http_request.status is None or http_request.status < 400:
-            self._logger.info(log_line, extra=dict(timestamp=request_time))
+            level = logging.INFO
         elif http_request.status < 500:
-            self._logger.warning(log_line, extra=dict(timestamp=request_time))
+            level = logging.WARNING
+        else:
+            level = logging.ERROR
+        # Skip building the log line altogether if it would just be discarded
+        if not self._logger.isEnabledFor(level):
+            return
+
+        timestamp = request_time.strftime("%d/%b/%Y:%H:%M:%S %z")
+        # Pass the request time pre-rendered so the formatter doesn't need to convert it
+        extra = dict(timestamp_iso=request_time.isoformat())
+        url_with_query = http_request.request_target
+        if self._use_fast_format:
+            remote_addr = http_request.remote_ip
+            user_id = get_user_id()
+            status_code = http_request.status
+            response_length = http_request.response_size
+            referer = http_request.referer
+            user_agent = http_request.user_agent
+            log_line = (
+                f"{remote_addr if remote_addr is not None else '-'} - "
+                f"{user_id if user_id is not None else '-'} [{timestamp}] "
+                f"{http_request.method} {url_with_query} {http_request.protocol} "
+                f"{status_code if status_code is not None else '-'} "
+                f"{response_length if response_length is not None else '-'} "
+                f'"{referer if referer is not None else "-"}" '
+                f'"{user_agent if user_agent is not None else "-"}"'
+            )
         else:
-            self._logger.error(log_line, extra=dict(timestamp=request_time))
+            data = _DashDict(
+                remote_addr=http_request.remote_ip,
+                ident=None,
+                user_id=get_user_id(),
+                timestamp=timestamp,
+                request_line=f"{http_request.method} {url_with_query} {http_request.protocol}",
+                status_code=http_request.status,
+                response_length=http_request.response_size,
+                referer=http_request.referer,
+                user_agent=http_request.user_agent,
+            )
+            log_line = self._access_log_message_format.format_map(data)
+
+        self._logger.log(level, log_line, extra=extra)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._handler.start()
         if scope["type"] != "http":
             return await self._app(scope, receive, send)  # pragma: no cover
 
@@ -139,12 +326,15 @@ class GKELoggingMiddleware:
             """
             if message["type"] == "http.response.start":  # Capture response data
                 http_request.status = message["status"]
-                response_headers = Headers(raw=message.get("headers", {}))
                 # TODO: Confirm this behavior for streaming responses
-                http_request.response_size = response_headers.get("content-length")
+                for name, value in message.get("headers", ()):
+                    if name == b"content-length":
+                        http_request.response_size = value.decode("latin-1")
+                        break
             await send(message)
 
-        start_time = time.time()
+        # Use a monotonic clock so that latency is unaffected by system clock adjustments
+        start_ns = time.perf_counter_ns()
         try:
             # Continue along to the next set of middleware or endpoint, but with the send_wrapper
             # instead
@@ -156,6 +346,6 @@ class GKELoggingMiddleware:
             raise
         finally:
             # Finally record the total response latency and log the request to the access log
-            end_time = time.time()
-            http_request.latency = f"{end_time - start_time:.5f}s"
+            elapsed_ns = time.perf_counter_ns() - start_ns
+            http_request.latency = f"{elapsed_ns / 1e9:.5f}s"
             self.log_request(request_time, http_request)
@@ -1,3 +1,4 @@
+import types
 import typing
 
 from contextvars import ContextVar
@@ -11,6 +12,9 @@ USER_ID: ContextVar[str] = ContextVar("user_id")
 SPAN_ID: ContextVar[str] = ContextVar("span_id")
 REQUEST: ContextVar["HttpRequest"] = ContextVar("request")
 
+# Shared read-only default for when no labels have been set
+_EMPTY: typing.Mapping[str, str] = types.MappingProxyType({})
+
 
 def utcnow() -> datetime:
     """
@@ -37,23 +41,31 @@ def add_label(label: str, value: str) -> None:
     """
     Adds an arbitrary label to the current logging context
     """
-    labels = LABELS.get({})
-    labels[label] = value
-    LABELS.set(labels)
+    # Always set a new dict rather than mutating the current one, which may be shared with other
+    # contexts copied from this one
+    LABELS.set({**LABELS.get(_EMPTY), label: value})
 
 
 def set_labels(**labels) -> None:
     """
     Sets multiple labels for the current logging context
+
+    The stored dict is never mutated afterwards, only replaced, so that it can be safely shared
+    with any contexts copied from this one
     """
     LABELS.set(labels)
 
 
 def get_labels() -> typing.Mapping[str, str]:
     """
-    Retrieves the current labels, or an empty dict if none have been set
+    Retrieves a read-only view of the current labels, or an empty mapping if none have been set
+
+    Use add_label() or set_labels() to change the current labels
     """
-    return LABELS.get({})
+    labels = LABELS.get(None)
+    if labels is None:
+        return _EMPTY
+    return types.MappingProxyType(labels)
 
 
 def set_span_id(span_id: str) -> None:
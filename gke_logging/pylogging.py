@@ -1,12 +1,18 @@
 import logging
 import typing
 
-from datetime import datetime
+from datetime import datetime, timezone
 
-from .context import get_http_request, get_labels, get_span_id, utcnow
-from .types import LogEntry, LogLevel, SourceLocation
+from ._json import dumps
+from .context import _EMPTY, LABELS, REQUEST, SPAN_ID
+from .types import LogLevel
 
 
+# Plain dict lookup of the Google Cloud severity for each Python log level name, rather than going
+# through the LogLevel enum for every record
+_SEVERITIES: typing.Dict[str, str] = {level.name: level.value for level in LogLevel}
+_DEFAULT_SEVERITY = LogLevel.DEFAULT.value
+
 LabelOrGetter = typing.Union[str, typing.Callable[[logging.LogRecord], str]]
 
 
@@ -26,12 +32,35 @@ class GKELoggingFormatter(logging.Formatter):
     as application identifiers, version numbers, environments, etc. These default labels can be
     expressed either as static strings, or functions that can compute a value given a LogRecord
 
+    Records below min_level are formatted as an empty string without doing any other work. This is
+    a safeguard for handlers shared across loggers, and is no substitute for setting levels on the
+    loggers and handlers themselves, since the handler will still receive the empty string
+
     See https://cloud.google.com/logging/docs/structured-logging
     """
 
-    def __init__(self, default_labels: typing.Mapping[str, LabelOrGetter] = {}):
+    def __init__(
+        self,
+        default_labels: typing.Mapping[str, LabelOrGetter] = {},
+        min_level: int = logging.NOTSET,
+    ):
         super().__init__()
-        self._default_labels = default_labels
+        self._min_level = min_level
+        # Split static labels from label getters up front so that only the getters need to be
+        # evaluated per record
+        self._static_labels: typing.Dict[str, str] = {}
+        self._dynamic_labels: typing.Dict[
+            str, typing.Callable[[logging.LogRecord], str]
+        ] = {}
+        for k, v in default_labels.items():
+            if callable(v):
+                self._dynamic_labels[k] = v
+            else:
+                self._static_labels[k] = v
+        # Source locations keyed by logger call site, of which there are only so many per process
+        self._source_locations: typing.Dict[
+            typing.Tuple[str, int, str], typing.Dict[str, str]
+        ] = {}
 
     def _get_labels(self, record: logging.LogRecord) -> typing.Mapping[str, str]:
         """
@@ -41,30 +70,77 @@ class GKELoggingFormatter(logging.Formatter):
           - "Contextual labels" configured in the current task context
           - LogRecord "extras" set at point of the logger use
         """
-        default_labels = {
-            k: v(record) if callable(v) else v for k, v in self._default_labels.items()
-        }
+        if not self._dynamic_labels:
+            return {
+                **self._static_labels,
+                **LABELS.get(_EMPTY),
+                **(record.__dict__.get("labels") or {}),
+            }
         return {
-            **default_labels,
-            **get_labels(),
-            **record.__dict__.get("labels", {}),
+            **self._static_labels,
+            **{k: v(record) for k, v in self._dynamic_labels.items()},
+            **LABELS.get(_EMPTY),
+            **(record.__dict__.get("labels") or {}),
         }
 
+    def _get_message(self, record: logging.LogRecord) -> str:
+        """
+        Renders the log message along with any exception or stack info, only interpolating the
+        message arguments when there are any
+        """
+        message = record.getMessage() if record.args else str(record.msg)
+        if record.exc_info is None and record.stack_info is None:
+            return message
+        # Mirrors logging.Formatter.format, without the extra formatMessage() pass
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            if message[-1:] != "\n":
+                message += "\n"
+            message += record.exc_text
+        if record.stack_info:
+            if message[-1:] != "\n":
+                message += "\n"
+            message += self.formatStack(record.stack_info)
+        return message
+
     def format(self, record: logging.LogRecord) -> str:
-        timestamp: datetime = record.__dict__.get("timestamp", utcnow())
-        log_entry = LogEntry(
-            time=timestamp,
-            severity=LogLevel[record.levelname],
-            message=super().format(record),
-            http_request=get_http_request(),
-            source_location=SourceLocation(
-                file=record.pathname,
-                line=f"{record.lineno}",
-                function=record.funcName,
-            ),
-            span_id=get_span_id(),
-            labels=self._get_labels(record),
+        if record.levelno < self._min_level:
+            return ""
+        # Either a pre-rendered ISO-8601 string, or a datetime which the serializer renders itself
+        timestamp: typing.Union[str, datetime, None] = record.__dict__.get(
+            "timestamp_iso"
         )
-        # Output the JSON by pydantic field "alias" so that we can use non-field-friendly output
-        # keys
-        return log_entry.json(by_alias=True, exclude_none=True)
+        if timestamp is None:
+            timestamp = record.__dict__.get("timestamp")
+            if timestamp is None:
+                # The record creation time is already captured via time.time()
+                timestamp = datetime.fromtimestamp(record.created, tz=timezone.utc)
+        # Build the LogEntry directly keyed by the Google Cloud field names, skipping any fields
+        # that are unset, rather than paying for model validation on every record
+        # See https://cloud.google.com/logging/docs/structured-logging#special-payload-fields
+        entry: typing.Dict[str, typing.Any] = {
+            "time": timestamp,
+            "severity": _SEVERITIES.get(record.levelname, _DEFAULT_SEVERITY),
+            "message": self._get_message(record),
+        }
+        span_id = SPAN_ID.get(None)
+        if span_id is not None:
+            entry["logging.googleapis.com/spanId"] = span_id
+        call_site = (record.pathname, record.lineno, record.funcName)
+        source_location = self._source_locations.get(call_site)
+        if source_location is None:
+            source_location = self._source_locations[call_site] = {
+                "file": record.pathname,
+                "line": f"{record.lineno}",
+                "function": record.funcName,
+            }
+        entry["logging.googleapis.com/sourceLocation"] = source_location
+        entry["logging.googleapis.com/labels"] = self._get_labels(record)
+        output = dumps(entry)
+        http_request = REQUEST.get(None)
+        if http_request is not None:
+            # The request is spliced in pre-serialized so that its request-line fields only need
+            # to be encoded once per request, no matter how many entries are logged
+            output = f'{output[:-1]},"httpRequest":{http_request.to_log_json()}}}'
+        return output
@@ -1,8 +1,13 @@
+import dataclasses
+import sys
 import typing
 
 from datetime import datetime
 from enum import Enum
-from pydantic import AfterValidator, AnyHttpUrl, BaseModel, Field
+from pydantic import BaseModel, Field, field_serializer
+from urllib.parse import urlsplit
+
+from ._json import dumps
 
 
 class LogLevel(str, Enum):
@@ -23,51 +28,129 @@ class LogLevel(str, Enum):
     EMERGENCY = "EMERGENCY"
 
 
-def _check_method(method: str):
-    if method.lower() not in (
-        "get",
-        "post",
-        "patch",
-        "put",
-        "delete",
-        "options",
-        "head",
-        "connect",
-    ):
-        raise ValueError(f"Invalid HTTP method: {method}")
-    return method
-
+# Slots make for cheaper construction and attribute access, but are only supported by
+# dataclasses from Python 3.10 onwards
+_DATACLASS_OPTIONS: typing.Dict[str, typing.Any] = (
+    {"slots": True} if sys.version_info >= (3, 10) else {}
+)
 
-HttpMethod = typing.Annotated[str, AfterValidator(_check_method)]
+# Google Cloud field names for HttpRequest fields whose names differ
+_HTTP_REQUEST_ALIASES = {
+    "method": "requestMethod",
+    "url": "requestUrl",
+    "request_size": "requestSize",
+    "user_agent": "userAgent",
+    "remote_ip": "remoteIp",
+    "server_ip": "serverIp",
+    "response_size": "responseSize",
+}
+_HTTP_RESPONSE_FIELDS = ("status", "response_size", "latency")
 
 
-class HttpRequest(BaseModel):
+@dataclasses.dataclass(**_DATACLASS_OPTIONS)
+class HttpRequest:
     """
     Typed model to match Google Cloud Logging's HttpRequest
 
+    This is a plain dataclass rather than a pydantic model, since one is constructed for every
+    incoming request and its fields are set from already-validated ASGI data
+
     See https://cloud.google.com/logging/docs/reference/v2/rest/v2/LogEntry#httprequest
     """
 
     protocol: str
-    method: HttpMethod = Field(serialization_alias="requestMethod")
-    url: AnyHttpUrl = Field(serialization_alias="requestUrl")
-    request_size: typing.Optional[str] = Field(
-        default=None, serialization_alias="requestSize"
-    )
-    user_agent: typing.Optional[str] = Field(
-        default=None, serialization_alias="userAgent"
-    )
-    remote_ip: typing.Optional[str] = Field(
-        default=None, serialization_alias="remoteIp"
-    )
-    server_ip: str = Field(serialization_alias="serverIp")
+    method: str
+    url: str
+    server_ip: str
+    request_size: typing.Optional[str] = None
+    user_agent: typing.Optional[str] = None
+    remote_ip: typing.Optional[str] = None
     referer: typing.Optional[str] = None
     status: typing.Optional[int] = None
-    response_size: typing.Optional[str] = Field(
-        default=None, serialization_alias="responseSize"
-    )
+    response_size: typing.Optional[str] = None
     latency: typing.Optional[str] = None
 
+    _static_json: typing.Optional[str] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _request_target: typing.Optional[str] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __setattr__(self, name: str, value: typing.Any) -> None:
+        object.__setattr__(self, name, value)
+        # Any change to a request-line field invalidates its cached JSON, e.g. when app code
+        # overrides remote_ip with a forwarded address mid-request
+        if name not in _HTTP_RESPONSE_FIELDS and not name.startswith("_"):
+            object.__setattr__(self, "_static_json", None)
+        # A recorded request target no longer applies once the URL itself changes
+        if name == "url":
+            object.__setattr__(self, "_request_target", None)
+
+    def set_request_target(self, request_target: str) -> None:
+        """
+        Records the request target, i.e. the path and query string as sent by the client, so that
+        it doesn't need to be parsed back out of the URL
+        """
+        self._request_target = request_target
+
+    @property
+    def request_target(self) -> str:
+        """
+        The request target, i.e. the path and query string, as used in the HTTP request line
+
+        This is the value recorded via set_request_target(), or otherwise derived from the URL
+        """
+        if self._request_target is not None:
+            return self._request_target
+        url = urlsplit(self.url)
+        request_target = url.path or "/"
+        if url.query:
+            request_target += f"?{url.query}"
+        return request_target
+
+    def _to_log_fields(
+        self, exclude: typing.Container[str] = ()
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Returns the set fields of this request, keyed by Google Cloud field names
+        """
+        fields = {}
+        for f in dataclasses.fields(self):
+            if f.name.startswith("_") or f.name in exclude:
+                continue
+            value = getattr(self, f.name)
+            if value is not None:
+                fields[_HTTP_REQUEST_ALIASES.get(f.name, f.name)] = value
+        return fields
+
+    def freeze_static_fields(self) -> None:
+        """
+        Caches the serialized JSON of the request-line fields, which don't change over the course
+        of a request, so that each log entry only needs to serialize the response fields
+
+        The cache is dropped whenever a request-line field is reassigned, and rebuilt on the next
+        call to to_log_json()
+        """
+        static_fields = self._to_log_fields(exclude=_HTTP_RESPONSE_FIELDS)
+        # Strip the enclosing braces so the response fields can be appended
+        self._static_json = dumps(static_fields)[1:-1]
+
+    def to_log_json(self) -> str:
+        """
+        Returns the JSON representation of this request, keyed by Google Cloud field names
+        """
+        if self._static_json is None:
+            self.freeze_static_fields()
+        parts = [typing.cast(str, self._static_json)]
+        if self.status is not None:
+            parts.append(f'"status":{self.status}')
+        if self.response_size is not None:
+            parts.append(f'"responseSize":{dumps(self.response_size)}')
+        if self.latency is not None:
+            parts.append(f'"latency":{dumps(self.latency)}')
+        return "{" + ",".join(parts) + "}"
+
 
 class SourceLocation(BaseModel):
     """
@@ -104,3 +187,12 @@ class LogEntry(BaseModel):
     labels: typing.Mapping[str, str] = Field(
         default_factory=dict, serialization_alias="logging.googleapis.com/labels"
     )
+
+    @field_serializer("http_request")
+    def _serialize_http_request(
+        self, http_request: typing.Optional[HttpRequest]
+    ) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        # HttpRequest is a plain dataclass, so its Google Cloud field names are applied here
+        if http_request is None:
+            return None
+        return http_request._to_log_fields()